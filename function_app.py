@@ -1,305 +1,632 @@
-import azure.functions as func
-import requests
-import logging
-from msal import PublicClientApplication
-import json
-from datetime import datetime
-from notifications.extract_notificacions import extract_notification_email
-from payments.extract_payments import get_html_payment
-from invoices.extract_invoice_attachment import extract_enel_invoice
-from invoices.get_attachment_invoices import extract_invoice
-from keys import *
-
-
-app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
-
-@app.route(route="auth")
-@app.queue_output(arg_name="queue_device_flow", 
-                  queue_name="auth-state-queue", 
-                  connection="AzureWebJobsStorage")
-def auth(req: func.HttpRequest, queue_device_flow: func.Out[str]) -> func.HttpResponse:
-    logging.info('Auth route triggered.')
-
-    try:
-        msal_app = PublicClientApplication(CLIENT_ID, authority=AUTHORITY)
-
-
-        device_flow = msal_app.initiate_device_flow(scopes=SCOPES)
-        if 'user_code' not in device_flow:
-            return func.HttpResponse("Error al iniciar el flujo de dispositivo.", status_code=500)
-
-        html = f"""
-        <html>
-        <body>
-            <h1>Microsoft Graph Authorization</h1>
-            <p>1️⃣ Ve a este enlace para autorizar:</p>
-            <a href="{device_flow['verification_uri']}">{device_flow['verification_uri']}</a>
-            <p>2️⃣ Escribe el código: <b>{device_flow['user_code']}</b></p>
-        </body>
-        </html>
-        """
-        serializable_flow = {k: v for k, v in device_flow.items() if not k.startswith('_')}
-        queue_device_flow.set(json.dumps(serializable_flow))
-
-        return func.HttpResponse(html, mimetype="text/html", status_code=200)
-
-    except Exception as e:
-        logging.error("Error durante autenticación: %s", str(e))
-        return func.HttpResponse(f"Error durante autenticación: {str(e)}", status_code=500)
-
-
-@app.function_name(name="get_messages")
-@app.queue_trigger(arg_name="queue_device_flow", queue_name="auth-state-queue",
-                   connection="AzureWebJobsStorage")
-@app.blob_output(arg_name="notificationsBlob",
-                 path="messages/notifications.json",
-                 connection="AzureWebJobsStorage")
-@app.blob_output(arg_name="invoicesBlob",
-                 path="messages/invoices.json",
-                 connection="AzureWebJobsStorage")
-@app.blob_output(arg_name="statementsBlob",
-                 path="messages/statements.json",
-                 connection="AzureWebJobsStorage")
-@app.blob_output(arg_name="paymentsBlob",
-                 path="messages/payments.json",
-                 connection="AzureWebJobsStorage")
-@app.queue_output(arg_name="notifications_queue", queue_name="notifications-queue",
-                  connection="AzureWebJobsStorage")
-@app.queue_output(arg_name="invoices_queue", queue_name="invoices-queue",
-                  connection="AzureWebJobsStorage")
-@app.queue_output(arg_name="statements_queue", queue_name="statements-queue",
-                  connection="AzureWebJobsStorage")
-@app.queue_output(arg_name="payments_queue", queue_name="payments-queue",
-                  connection="AzureWebJobsStorage")
-def get_messages(queue_device_flow: func.QueueMessage, 
-                notificationsBlob: func.Out[str],
-                invoicesBlob: func.Out[str],
-                statementsBlob: func.Out[str],
-                paymentsBlob: func.Out[str],
-                notifications_queue: func.Out[str], 
-                invoices_queue: func.Out[str],
-                payments_queue: func.Out[str],
-                statements_queue: func.Out[str]) -> None:
-    logging.info("Intentando obtener carpetas de correo...")
-    today = datetime.today().strftime('%Y-%m-%d')
-    try:
-        msal_app = PublicClientApplication(CLIENT_ID, authority=AUTHORITY)
-        body = queue_device_flow.get_body().decode('utf-8')
-        TOKENS['device_flow'] = json.loads(body)
-        result = msal_app.acquire_token_by_device_flow(TOKENS['device_flow'])
-
-        TOKENS['access_token'] = result['access_token']
-        TOKENS['headers'] = {"Authorization": f"Bearer {TOKENS['access_token']}"}
-        
-        response = requests.get(f"{GRAPH_BASE_URL}/me/mailFolders", headers=TOKENS['headers'])
-        response.raise_for_status()
-        if response.status_code != 200:
-            logging.error(f"Error obteniendo carpetas: {response.text}")
-            return
-        
-        folders = response.json()
-        for folder in folders.get('value', []):
-            if folder.get('displayName') in INBOX_NAMES:
-                inbox_id = folder.get('id')
-        
-        if not inbox_id:
-            logging.warning("No se encontró la carpeta de entrada.")
-            return
-    
-        logging.info(f"Carpeta de entrada ID: {inbox_id}")
-
-        path = f"{GRAPH_BASE_URL}/me/mailFolders/{inbox_id}/messages?$top={MESSAGE_LIMIT}"
-        response = requests.get(path, headers=TOKENS['headers'])
-        response.raise_for_status()
-        messages_data = response.json()
-        messages = messages_data.get('value', [])
-        if len(messages) == 0:
-            logging.info("No se encontraron mensajes en la bandeja de entrada.")
-            return
-        
-        logging.info(f"Se encontraron {len(messages)} mensajes en la bandeja de entrada.")
-
-        invoices_data = []
-        notifications_data = []
-        statetmens_data = []
-        payments_data = []
-        for message in messages:
-            msg_id = message.get('id')
-            subject = message.get('subject')
-            body_preview = message.get('bodyPreview')
-            attachments = message.get('hasAttachments')
-            content = message.get('body', {}).get('content')
-            sender = message.get('sender', {}).get('emailAddress', {}).get('address')
-        
-            if subject == 'Alertas y Notificaciones' or 'Alertas y Notificaciones' in body_preview:
-                msg_type =  'notification'
-            elif (any(kw in body_preview for kw in PAYMENT_KEYWORDS) or
-                any(kw in subject for kw in PAYMENT_KEYWORDS)) and not any(kw in sender for kw in INVOICE_KEYWORDS):
-                msg_type = 'payment'
-            elif any(kw in body_preview for kw in EXTRACT_KEYWORDS) or any(kw in subject for kw in EXTRACT_KEYWORDS):
-                msg_type = 'extract'
-            elif any(kw in body_preview for kw in INVOICE_KEYWORDS) or any(kw in subject for kw in INVOICE_KEYWORDS):
-                msg_type = 'invoice'
-            else:
-                msg_type = 'other'
-            
-            msg_data = {
-                'id': msg_id,
-                'subject': subject,
-                'body': body_preview,
-                'attachments': attachments,
-                'sender': sender,
-                'type': msg_type,
-                'content': content
-            }    
-
-            if msg_type == 'notification':
-                notifications_data.append(msg_data)
-            elif msg_type == 'payment':
-                payments_data.append(msg_data)
-            elif msg_type == 'extract':
-                statetmens_data.append(msg_data)
-            elif msg_type == 'invoice':
-                invoices_data.append(msg_data)
-
-            logging.info(f"Procesado mensaje ID: {msg_id}, Tipo: {msg_type}")
-        
-        notificationsBlob.set(json.dumps(notifications_data))
-        notifications_queue.set(json.dumps(TOKENS['headers']))
-        logging.info("Cola de notificaciones actualizada.")
-
-        invoicesBlob.set(json.dumps(invoices_data))
-        invoices_queue.set(json.dumps(TOKENS['headers']))
-        logging.info("Cola de facturas actualizada.")
-
-        statementsBlob.set(json.dumps(statetmens_data))
-        statements_queue.set(json.dumps(TOKENS['headers']))
-        logging.info("Cola de extractos actualizada.")
-
-        paymentsBlob.set(json.dumps(payments_data))
-        payments_queue.set(json.dumps(TOKENS['headers']))
-        logging.info("Cola de pagos actualizada.")
-        
-    except Exception as e:
-        logging.error("Error obteniendo token: %s", str(e))
-        return
-
-
-@app.function_name(name="extract_notifications")
-@app.queue_trigger(arg_name="notifications_queue", queue_name="notifications-queue",
-                   connection="AzureWebJobsStorage")
-@app.blob_input(arg_name="inputBlob",
-                path="messages/notifications.json",
-                connection="AzureWebJobsStorage")
-@app.blob_output(arg_name="outputBlob",
-                 path="processed-data/extracted_notifications_{datetime}.json",
-                 connection="AzureWebJobsStorage")
-def extract_notifications(notifications_queue: func.QueueMessage, inputBlob: str, outputBlob: func.Out[str]) -> None:
-    logging.info("Procesando notificaciones...")
-    try:
-        today = datetime.today().strftime('%Y-%m-%d')
-        headers = json.loads(notifications_queue.get_body().decode('utf-8'))
-        logging.info(f"Headers recibidos para extracción: {headers}")
-
-        notifications_data = json.loads(inputBlob)
-        logging.info(f"Número de notificaciones a procesar: {len(notifications_data)}")
-        
-        extracted_data = []
-        for msg in notifications_data:
-            body_preview = msg.get('body', '')
-            if body_preview:
-                extracted = extract_notification_email(body_preview)
-                extracted['id'] = msg.get('id')
-                extracted['subject'] = msg.get('subject')
-                extracted_data.append(extracted)
-        
-        outputBlob.set(json.dumps(extracted_data))
-        logging.info(f"Extraídas {len(extracted_data)} notificaciones.")
-    except Exception as e:
-        logging.error(f"Error procesando notificaciones: {str(e)}")
-
-
-@app.function_name(name="extract_payments")
-@app.queue_trigger(arg_name="payments_queue", queue_name="payments-queue",
-                   connection="AzureWebJobsStorage")
-@app.blob_input(arg_name="inputBlob",
-                path="messages/payments.json",
-                connection="AzureWebJobsStorage")
-@app.blob_output(arg_name="outputBlob",
-                 path="processed-data/extracted_payments_{datetime}.json",
-                 connection="AzureWebJobsStorage")
-def extract_payments(payments_queue: func.QueueMessage, inputBlob: str, 
-                     outputBlob: func.Out[str]) -> None:
-    """
-        Function to extract payment information from email messages.
-    Args:
-        payments_queue (func.QueueMessage): Queue message containing headers for authentication.
-        inputBlob (str): Blob input containing raw email messages in JSON format.
-        outputBlob (func.Out[str]): Blob output to store extracted payment information in JSON format.
-    Returns:
-        None
-    """
-    logging.info("Procesando pagos...")
-    try:
-        headers = json.loads(payments_queue.get_body().decode('utf-8'))
-        payments_data = json.loads(inputBlob)
-        logging.info(f"Número de pagos a procesar: {len(payments_data)}")
-        extracted_data = []
-        for msg in payments_data:
-            id = msg.get('id')
-            info = get_html_payment(id, headers)
-            if info:
-                logging.info(f"Pago extraído para mensaje ID: {id}")
-                extracted_data.append(info)
-        
-        outputBlob.set(json.dumps(extracted_data))
-        logging.info(f"Extraídos {len(extracted_data)} pagos.")
-    except Exception as e:
-        logging.error(f"Error procesando pagos: {str(e)}")
-
-
-@app.function_name(name="extract_invoices")
-@app.queue_trigger(arg_name="invoices_queue", queue_name="invoices-queue",
-                   connection="AzureWebJobsStorage")
-@app.blob_input(arg_name="inputBlob",
-                path="messages/invoices.json",
-                connection="AzureWebJobsStorage")
-@app.blob_output(arg_name="outputBlob",
-                 path="processed-data/extracted_invoices_{datetime}.json",
-                 connection="AzureWebJobsStorage")
-@app.blob_output(arg_name="attachmentsBlob",
-                 path="raw-data/invoice_attachments_{datetime}",
-                 connection="AzureWebJobsStorage")
-def extract_invoices(invoices_queue: func.QueueMessage, inputBlob: str, 
-                     outputBlob: func.Out[str], attachmentsBlob: func.Out[str]) -> None:
-    """
-        Function to extract invoice information from email messages.
-    Args:
-        invoices_queue (func.QueueMessage): Queue message containing headers for authentication.
-        inputBlob (str): Blob input containing raw email messages in JSON format.
-        outputBlob (func.Out[str]): Blob output to store extracted invoice information in JSON format.
-        attachmentsBlob (func.Out[str]): Blob output to store raw attachments.
-    Returns:
-        None
-    """
-    logging.info("Procesando facturas...")
-    try:
-        headers = json.loads(invoices_queue.get_body().decode('utf-8'))
-        invoices_data = json.loads(inputBlob)
-        logging.info(f"Número de facturas a procesar: {len(invoices_data)}")
-        extracted_data = []
-        for msg in invoices_data:
-            id = msg.get('id')
-            subject = msg.get('subject')
-            attachments = msg.get('attachments', False)
-            if 'Enel Colombia' in subject:
-                info = extract_enel_invoice(id, headers)
-            elif attachments:
-                info = extract_invoice(id, headers)
-                info.update({'subject': subject, 'ID_email': id})
-            extracted_data.append(info)
-        
-        outputBlob.set(json.dumps(extracted_data))
-        logging.info(f"Extraídas {len(extracted_data)} facturas.")
-    except Exception as e:
-        logging.error(f"Error procesando facturas: {str(e)}")
+import azure.functions as func
+import io
+import logging
+import os
+import time
+from msal import PublicClientApplication, SerializableTokenCache
+from azure.storage.blob import BlobClient
+import ahocorasick
+import ijson
+from ijson.common import ObjectBuilder
+import orjson
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List
+from graph_client import SESSION as _HTTP, REQUEST_TIMEOUT
+from keys import *
+
+# Los módulos de extracción (bs4, pypdf, fitz, pandas...) se importan de
+# forma perezosa dentro de cada handler: auth y get_messages no los usan
+# y su import domina el cold-start del worker.
+
+
+app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
+
+# Shared across invocations: the worker is reused while warm, so building these
+# once avoids re-paying MSAL discovery and TLS handshakes on every call.
+_TOKEN_CACHE = SerializableTokenCache()
+_MSAL_APP = PublicClientApplication(CLIENT_ID, authority=AUTHORITY,
+                                    token_cache=_TOKEN_CACHE)
+
+TOKEN_CACHE_BLOB = "auth/msal_cache.bin"
+
+
+def _build_classifier() -> ahocorasick.Automaton:
+    """Compila todas las keywords de clasificación en un solo automaton,
+    de forma que cada mensaje se clasifica con un único escaneo lineal.
+
+    Las keywords se normalizan a minúsculas; el texto se baja a minúsculas
+    una sola vez por mensaje antes de escanear."""
+    words = {}
+    for label, keywords in (('payment', PAYMENT_KEYWORDS),
+                            ('extract', EXTRACT_KEYWORDS),
+                            ('invoice', INVOICE_KEYWORDS)):
+        for kw in keywords:
+            words.setdefault(kw.lower(), set()).add(label)
+
+    automaton = ahocorasick.Automaton()
+    for kw, labels in words.items():
+        automaton.add_word(kw, labels)
+    automaton.make_automaton()
+    return automaton
+
+
+_CLASSIFIER = _build_classifier()
+
+# Keywords de facturación ya en minúsculas para el chequeo de remitente,
+# calculadas una vez en lugar de bajar a minúsculas en cada mensaje.
+_INVOICE_SENDER_KW = frozenset(kw.lower() for kw in INVOICE_KEYWORDS)
+
+MESSAGE_PAGE_SIZE = 50
+
+
+def _iter_messages(url: str, headers: dict, limit: int, state: dict = None):
+    """Genera mensajes siguiendo @odata.nextLink, parseando en streaming.
+
+    ijson consume response.raw conforme llegan los bytes, así que la
+    clasificación arranca antes de que termine la descarga y el pico de
+    memoria queda en un mensaje, no en la respuesta completa. Los
+    skiptokens no se pueden precalcular, así que cada página se pide en
+    cuanto llega el enlace de la siguiente. Si se pasa `state`, el
+    @odata.deltaLink de la última página se deja en state['delta_link'];
+    si la enumeración se corta por `limit`, el @odata.nextLink pendiente
+    queda en state['next_link'] para reanudar en el siguiente sondeo.
+
+    El corte se aplica solo en el límite de página: así el nextLink
+    guardado continúa exactamente donde quedó la enumeración y ningún
+    mensaje de una página a medio consumir se salta."""
+    count = 0
+    while url:
+        response = _HTTP.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        response.raw.decode_content = True
+
+        url = None
+        builder = None
+        for prefix, event, value in ijson.parse(response.raw):
+            if (prefix, event) == ('value.item', 'start_map'):
+                builder = ObjectBuilder()
+            if builder is not None:
+                builder.event(event, value)
+                if (prefix, event) == ('value.item', 'end_map'):
+                    yield builder.value
+                    builder = None
+                    count += 1
+            elif prefix == '@odata.nextLink':
+                url = value
+            elif prefix == '@odata.deltaLink' and state is not None:
+                state['delta_link'] = value
+
+        if url and count >= limit:
+            if state is not None:
+                state['next_link'] = url
+            return
+
+
+GRAPH_BATCH_LIMIT = 20
+_BATCH_RETRIES = 3
+_BATCH_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _batch_get(headers: dict, urls: list) -> list:
+    """Agrupa GETs a Graph en llamadas /\\$batch de hasta 20 subpeticiones.
+
+    Las urls son relativas a la versión (p.ej. '/me/messages/{id}/attachments').
+    Las subpeticiones estranguladas (429) o con error transitorio se
+    reemiten respetando el Retry-After de la subrespuesta: con el sondeo
+    delta cada mensaje se ve una sola vez, así que dejarlas caer lo
+    perdería de forma permanente. Devuelve los cuerpos JSON en el mismo
+    orden que `urls`, con None para las que fallaron tras los reintentos."""
+    results = [None] * len(urls)
+    pending = list(range(len(urls)))
+    for attempt in range(_BATCH_RETRIES + 1):
+        retry_ids = []
+        retry_after = 0.0
+        for start in range(0, len(pending), GRAPH_BATCH_LIMIT):
+            chunk = pending[start:start + GRAPH_BATCH_LIMIT]
+            payload = {"requests": [{"id": str(i), "method": "GET", "url": urls[i]}
+                                    for i in chunk]}
+            response = _HTTP.post(f"{GRAPH_BASE_URL}/$batch", headers=headers, json=payload,
+                                  timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            for sub in orjson.loads(response.content).get('responses', []):
+                idx = int(sub['id'])
+                status = sub.get('status')
+                if status == 200:
+                    results[idx] = sub.get('body')
+                elif status in _BATCH_RETRY_STATUSES:
+                    retry_ids.append(idx)
+                    ra = next((v for k, v in (sub.get('headers') or {}).items()
+                               if k.lower() == 'retry-after'), 0)
+                    try:
+                        retry_after = max(retry_after, float(ra))
+                    except (TypeError, ValueError):
+                        pass
+                else:
+                    logging.warning(f"Subpetición {idx} falló con estado {status}")
+        if not retry_ids:
+            break
+        if attempt < _BATCH_RETRIES:
+            time.sleep(retry_after or 0.2 * (2 ** attempt))
+            pending = retry_ids
+        else:
+            logging.warning(f"Subpeticiones {retry_ids} agotaron los reintentos")
+    return results
+
+
+def _token_cache_blob() -> BlobClient:
+    return BlobClient.from_connection_string(
+        os.environ["AzureWebJobsStorage"],
+        container_name="auth-cache",
+        blob_name=TOKEN_CACHE_BLOB)
+
+
+DELTA_LINK_BLOB = "state/messages_delta.txt"
+
+
+def _delta_link_blob() -> BlobClient:
+    return BlobClient.from_connection_string(
+        os.environ["AzureWebJobsStorage"],
+        container_name="auth-cache",
+        blob_name=DELTA_LINK_BLOB)
+
+
+def _load_delta_link():
+    """Devuelve el enlace del sondeo anterior, si existe: un deltaLink
+    completo o el nextLink pendiente de una sincronización cortada."""
+    try:
+        blob = _delta_link_blob()
+        if blob.exists():
+            return blob.download_blob().readall().decode('utf-8')
+    except Exception as e:
+        logging.warning("No se pudo cargar el delta link: %s", str(e))
+    return None
+
+
+def _save_delta_link(link: str) -> None:
+    try:
+        _delta_link_blob().upload_blob(link, overwrite=True)
+    except Exception as e:
+        logging.warning("No se pudo guardar el delta link: %s", str(e))
+
+
+def _load_token_cache() -> None:
+    """Carga el token cache de MSAL desde el blob, si existe."""
+    try:
+        blob = _token_cache_blob()
+        if blob.exists():
+            _TOKEN_CACHE.deserialize(blob.download_blob().readall().decode('utf-8'))
+    except Exception as e:
+        logging.warning("No se pudo cargar el token cache: %s", str(e))
+
+
+def _save_token_cache() -> None:
+    """Sube el token cache de MSAL al blob si cambió."""
+    if not _TOKEN_CACHE.has_state_changed:
+        return
+    try:
+        _token_cache_blob().upload_blob(_TOKEN_CACHE.serialize(), overwrite=True)
+    except Exception as e:
+        logging.warning("No se pudo guardar el token cache: %s", str(e))
+
+
+def _acquire_token_silent() -> dict:
+    """Intenta obtener un token silenciosamente desde el cache persistente."""
+    _load_token_cache()
+    accounts = _MSAL_APP.get_accounts()
+    if accounts:
+        result = _MSAL_APP.acquire_token_silent(SCOPES, account=accounts[0])
+        if result and 'access_token' in result:
+            return result
+    return {}
+
+
+def _get_headers() -> dict:
+    """Headers de autorización para Graph desde el cache persistente de MSAL."""
+    result = _acquire_token_silent()
+    if not result:
+        raise RuntimeError("No hay token en el cache de MSAL; ejecutar /auth de nuevo.")
+    return {"Authorization": f"Bearer {result['access_token']}"}
+
+@app.route(route="auth")
+@app.queue_output(arg_name="queue_device_flow", 
+                  queue_name="auth-state-queue", 
+                  connection="AzureWebJobsStorage")
+def auth(req: func.HttpRequest, queue_device_flow: func.Out[str]) -> func.HttpResponse:
+    logging.info('Auth route triggered.')
+
+    try:
+        device_flow = _MSAL_APP.initiate_device_flow(scopes=SCOPES)
+        if 'user_code' not in device_flow:
+            return func.HttpResponse("Error al iniciar el flujo de dispositivo.", status_code=500)
+
+        html = f"""
+        <html>
+        <body>
+            <h1>Microsoft Graph Authorization</h1>
+            <p>1️⃣ Ve a este enlace para autorizar:</p>
+            <a href="{device_flow['verification_uri']}">{device_flow['verification_uri']}</a>
+            <p>2️⃣ Escribe el código: <b>{device_flow['user_code']}</b></p>
+        </body>
+        </html>
+        """
+        serializable_flow = {k: v for k, v in device_flow.items() if not k.startswith('_')}
+        queue_device_flow.set(orjson.dumps(serializable_flow).decode())
+
+        return func.HttpResponse(html, mimetype="text/html", status_code=200)
+
+    except Exception as e:
+        logging.error("Error durante autenticación: %s", str(e))
+        return func.HttpResponse(f"Error durante autenticación: {str(e)}", status_code=500)
+
+
+@app.function_name(name="get_messages")
+@app.queue_trigger(arg_name="queue_device_flow", queue_name="auth-state-queue",
+                   connection="AzureWebJobsStorage")
+@app.blob_output(arg_name="messagesBlob",
+                 path="messages/messages.json",
+                 connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="notifications_queue", queue_name="notifications-queue",
+                  connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="invoices_queue", queue_name="invoices-queue",
+                  connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="statements_queue", queue_name="statements-queue",
+                  connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="payments_queue", queue_name="payments-queue",
+                  connection="AzureWebJobsStorage")
+def get_messages(queue_device_flow: func.QueueMessage,
+                messagesBlob: func.Out[str],
+                notifications_queue: func.Out[str],
+                invoices_queue: func.Out[List[str]],
+                payments_queue: func.Out[str],
+                statements_queue: func.Out[str]) -> None:
+    logging.info("Intentando obtener carpetas de correo...")
+    today = datetime.today().strftime('%Y-%m-%d')
+    try:
+        result = _acquire_token_silent()
+        if not result:
+            device_flow = orjson.loads(queue_device_flow.get_body())
+            result = _MSAL_APP.acquire_token_by_device_flow(device_flow)
+        _save_token_cache()
+
+        # Headers locales a la invocación: un global compartido se corrompe
+        # cuando el worker ejecuta invocaciones concurrentes.
+        headers = {"Authorization": f"Bearer {result['access_token']}"}
+
+        # Con un deltaLink persistido, el servidor devuelve solo los
+        # mensajes nuevos o modificados desde el último sondeo; la carpeta
+        # ya va implícita en el enlace, así que mailFolders ni se consulta.
+        path = _load_delta_link()
+        if not path:
+            # El filtro se resuelve en el servidor: la respuesta trae solo la
+            # carpeta de entrada en lugar de todas las carpetas del buzón.
+            folder_filter = " or ".join(f"displayName eq '{name}'" for name in INBOX_NAMES)
+            response = _HTTP.get(
+                f"{GRAPH_BASE_URL}/me/mailFolders?$filter={folder_filter}&$select=id,displayName",
+                headers=headers, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+
+            # orjson decodifica los bytes comprimidos directamente, sin pasar
+            # por el str intermedio de response.json().
+            folders = orjson.loads(response.content).get('value', [])
+            if not folders:
+                logging.warning("No se encontró la carpeta de entrada.")
+                return
+            inbox_id = folders[0]['id']
+
+            logging.info(f"Carpeta de entrada ID: {inbox_id}")
+
+            path = (f"{GRAPH_BASE_URL}/me/mailFolders/{inbox_id}/messages/delta"
+                    f"?$top={MESSAGE_PAGE_SIZE}"
+                    "&$select=id,subject,bodyPreview,hasAttachments,sender")
+
+        delta_state = {}
+        # Sumideros incrementales: cada mensaje se serializa una sola vez
+        # con orjson y se anexa al buffer de su categoría, de modo que no
+        # se acumulan listas de dicts ni hay una segunda pasada de
+        # serialización al final.
+        sinks = {'notification': bytearray(b'['),
+                 'payment': bytearray(b'['),
+                 'extract': bytearray(b'['),
+                 'invoice': bytearray(b'[')}
+        _other = bytearray(b'[')  # sumidero para mensajes tipo 'other'
+        invoice_msgs = []  # payloads de cola, uno por factura
+        processed = 0
+        for message in _iter_messages(path, headers, MESSAGE_LIMIT, state=delta_state):
+            if '@removed' in message:
+                continue
+            processed += 1
+            msg_id = message.get('id')
+            subject = message.get('subject')
+            body_preview = message.get('bodyPreview')
+            attachments = message.get('hasAttachments')
+            sender = message.get('sender', {}).get('emailAddress', {}).get('address')
+            sender_lower = (sender or '').lower()
+
+            hits = set()
+            for _, labels in _CLASSIFIER.iter(f"{subject}\n{body_preview}".lower()):
+                hits |= labels
+
+            if subject == 'Alertas y Notificaciones' or 'Alertas y Notificaciones' in body_preview:
+                msg_type =  'notification'
+            elif 'payment' in hits and not any(kw in sender_lower for kw in _INVOICE_SENDER_KW):
+                msg_type = 'payment'
+            elif 'extract' in hits:
+                msg_type = 'extract'
+            elif 'invoice' in hits:
+                msg_type = 'invoice'
+            else:
+                msg_type = 'other'
+            
+            msg_data = {
+                'id': msg_id,
+                'subject': subject,
+                'body': body_preview,
+                'attachments': attachments,
+                'sender': sender,
+                'type': msg_type
+            }
+
+            sink = sinks.get(msg_type, _other)
+            if len(sink) > 1:
+                sink += b','
+            sink += orjson.dumps(msg_data)
+
+            if msg_type == 'invoice':
+                # Las facturas se reparten en un mensaje de cola por correo,
+                # de modo que Azure Functions escale por invocaciones y un
+                # PDF lento no bloquee al resto del lote.
+                invoice_msgs.append(orjson.dumps({'id': msg_id,
+                                                  'subject': subject,
+                                                  'attachments': attachments}).decode())
+
+            logging.info(f"Procesado mensaje ID: {msg_id}, Tipo: {msg_type}")
+
+        # El siguiente sondeo arranca desde aquí aunque este lote venga
+        # vacío. Si el lote se cortó por MESSAGE_LIMIT se guarda el
+        # nextLink pendiente: la sincronización continúa donde quedó en
+        # vez de reiniciar la enumeración delta desde cero.
+        next_path = delta_state.get('delta_link') or delta_state.get('next_link')
+        if next_path:
+            _save_delta_link(next_path)
+
+        if processed == 0:
+            logging.info("No se encontraron mensajes en la bandeja de entrada.")
+            return
+
+        logging.info(f"Se encontraron {processed} mensajes en la bandeja de entrada.")
+
+        # Solo un id de correlación viaja por las colas; cada consumidor
+        # obtiene su token desde el cache persistente de MSAL.
+        batch = orjson.dumps({'batch_id': str(uuid.uuid4()), 'date': today}).decode()
+
+        # Un solo PUT de blob con las cuatro categorías, compuesto a partir
+        # de los buffers ya serializados sin volver a recorrer los mensajes.
+        messagesBlob.set(bytes(b'{"notifications":' + sinks['notification'] + b']'
+                               b',"invoices":' + sinks['invoice'] + b']'
+                               b',"statements":' + sinks['extract'] + b']'
+                               b',"payments":' + sinks['payment'] + b']}').decode())
+
+        notifications_queue.set(batch)
+        logging.info("Cola de notificaciones actualizada.")
+
+        invoices_queue.set(invoice_msgs)
+        logging.info("Cola de facturas actualizada.")
+
+        statements_queue.set(batch)
+        logging.info("Cola de extractos actualizada.")
+
+        payments_queue.set(batch)
+        logging.info("Cola de pagos actualizada.")
+        
+    except Exception as e:
+        logging.error("Error obteniendo token: %s", str(e))
+        return
+
+
+@app.function_name(name="extract_notifications")
+@app.queue_trigger(arg_name="notifications_queue", queue_name="notifications-queue",
+                   connection="AzureWebJobsStorage")
+@app.blob_input(arg_name="inputBlob",
+                path="messages/messages.json",
+                connection="AzureWebJobsStorage")
+@app.blob_output(arg_name="outputBlob",
+                 path="processed-data/extracted_notifications_{datetime}.json",
+                 connection="AzureWebJobsStorage")
+def extract_notifications(notifications_queue: func.QueueMessage, inputBlob: str, outputBlob: func.Out[str]) -> None:
+    logging.info("Procesando notificaciones...")
+    try:
+        from notifications.extract_notificacions import extract_notification_email
+
+        today = datetime.today().strftime('%Y-%m-%d')
+        batch = orjson.loads(notifications_queue.get_body())
+        logging.info(f"Procesando lote: {batch.get('batch_id')}")
+
+        notifications_data = orjson.loads(inputBlob).get('notifications', [])
+        logging.info(f"Número de notificaciones a procesar: {len(notifications_data)}")
+        
+        extracted_data = []
+        for msg in notifications_data:
+            body_preview = msg.get('body') or ''
+            # Los cuerpos vacíos o demasiado cortos nunca producen nada útil.
+            if len(body_preview) < 20:
+                continue
+            extracted = extract_notification_email(body_preview)
+            extracted['id'] = msg.get('id')
+            extracted['subject'] = msg.get('subject')
+            extracted_data.append(extracted)
+        
+        outputBlob.set(orjson.dumps(extracted_data).decode())
+        logging.info(f"Extraídas {len(extracted_data)} notificaciones.")
+    except Exception as e:
+        logging.error(f"Error procesando notificaciones: {str(e)}")
+
+
+@app.function_name(name="extract_payments")
+@app.queue_trigger(arg_name="payments_queue", queue_name="payments-queue",
+                   connection="AzureWebJobsStorage")
+@app.blob_input(arg_name="inputBlob",
+                path="messages/messages.json",
+                connection="AzureWebJobsStorage")
+@app.blob_output(arg_name="outputBlob",
+                 path="processed-data/extracted_payments_{datetime}.json",
+                 connection="AzureWebJobsStorage")
+def extract_payments(payments_queue: func.QueueMessage, inputBlob: str, 
+                     outputBlob: func.Out[str]) -> None:
+    """
+        Function to extract payment information from email messages.
+    Args:
+        payments_queue (func.QueueMessage): Queue message containing headers for authentication.
+        inputBlob (str): Blob input containing raw email messages in JSON format.
+        outputBlob (func.Out[str]): Blob output to store extracted payment information in JSON format.
+    Returns:
+        None
+    """
+    logging.info("Procesando pagos...")
+    try:
+        from payments.extract_payments import get_payment_from_message
+
+        batch = orjson.loads(payments_queue.get_body())
+        logging.info(f"Procesando lote: {batch.get('batch_id')}")
+        headers = _get_headers()
+        payments_data = orjson.loads(inputBlob).get('payments', [])
+        logging.info(f"Número de pagos a procesar: {len(payments_data)}")
+
+        # Los cuerpos de todos los pagos llegan en llamadas /$batch de 20
+        # subpeticiones en lugar de un GET por mensaje.
+        urls = [f"/me/messages/{msg.get('id')}?$select=id,subject,body,sender"
+                for msg in payments_data]
+        messages = _batch_get(headers, urls)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = executor.map(get_payment_from_message,
+                                   [data for data in messages if data])
+        extracted_data = [info for info in results if info]
+
+        outputBlob.set(orjson.dumps(extracted_data).decode())
+        logging.info(f"Extraídos {len(extracted_data)} pagos.")
+    except Exception as e:
+        logging.error(f"Error procesando pagos: {str(e)}")
+
+
+@app.function_name(name="extract_invoices")
+@app.queue_trigger(arg_name="invoices_queue", queue_name="invoices-queue",
+                   connection="AzureWebJobsStorage")
+# Los blobs se nombran por el id del mensaje de la cola: dos facturas
+# procesadas en el mismo instante no chocan, y un reintento del mismo
+# mensaje sobreescribe su propio resultado en vez de duplicarlo.
+@app.blob_output(arg_name="outputBlob",
+                 path="processed-data/extracted_invoices_{id}.json",
+                 connection="AzureWebJobsStorage")
+@app.blob_output(arg_name="attachmentsBlob",
+                 path="raw-data/invoice_attachments_{id}",
+                 connection="AzureWebJobsStorage")
+def extract_invoices(invoices_queue: func.QueueMessage,
+                     outputBlob: func.Out[str], attachmentsBlob: func.Out[str]) -> None:
+    """
+        Function to extract invoice information from a single email message.
+    Args:
+        invoices_queue (func.QueueMessage): Queue message with the id, subject
+            and attachment flag of one invoice email.
+        outputBlob (func.Out[str]): Blob output to store extracted invoice information in JSON format.
+        attachmentsBlob (func.Out[str]): Blob output to store raw attachments.
+    Returns:
+        None
+    """
+    logging.info("Procesando facturas...")
+    try:
+        from invoices.extract_invoice_attachment import extract_enel_invoice
+        from invoices.get_attachment_invoices import extract_invoice_from_attachments
+
+        msg = orjson.loads(invoices_queue.get_body())
+        headers = _get_headers()
+        id = msg.get('id')
+        subject = msg.get('subject', '')
+
+        info = None
+        if 'Enel Colombia' in subject:
+            info = extract_enel_invoice(id, headers)
+        elif msg.get('attachments', False):
+            attachments = _batch_get(
+                headers,
+                [f"/me/messages/{id}/attachments?$select=name,contentType,contentBytes,size"])[0]
+            if attachments:
+                info = extract_invoice_from_attachments(attachments.get('value', []))
+                if info:
+                    info.update({'subject': subject, 'ID_email': id})
+
+        if info:
+            outputBlob.set(orjson.dumps([info]).decode())
+            logging.info(f"Factura extraída para mensaje ID: {id}")
+    except Exception as e:
+        logging.error(f"Error procesando facturas: {str(e)}")
+
+
+@app.function_name(name="get_bank_statement")
+@app.queue_trigger(arg_name="statements_queue", queue_name="statements-queue",
+                   connection="AzureWebJobsStorage")
+@app.blob_input(arg_name="inputBlob",
+                path="messages/messages.json",
+                connection="AzureWebJobsStorage")
+@app.blob_output(arg_name="outputBlob",
+                 path="processed-data/extracted_statements_{datetime}.json",
+                 connection="AzureWebJobsStorage")
+def get_bank_statement(statements_queue: func.QueueMessage, inputBlob: str,
+                       outputBlob: func.Out[str]) -> None:
+    """
+        Function to extract bank statement information from email attachments.
+    Args:
+        statements_queue (func.QueueMessage): Queue message with the batch id.
+        inputBlob (str): Blob input containing the classified messages in JSON format.
+        outputBlob (func.Out[str]): Blob output to store extracted statements in JSON format.
+    Returns:
+        None
+    """
+    logging.info("Procesando extractos...")
+    try:
+        from invoices.decode_attachment import decode_attachment_bytes
+        from statements.extract_statements import (parse_credit_card_statement,
+                                                   parse_credit_statement,
+                                                   parse_savings_statement)
+
+        batch = orjson.loads(statements_queue.get_body())
+        logging.info(f"Procesando lote: {batch.get('batch_id')}")
+        headers = _get_headers()
+        statements_data = orjson.loads(inputBlob).get('statements', [])
+        logging.info(f"Número de extractos a procesar: {len(statements_data)}")
+
+        # Los adjuntos de todos los extractos llegan en llamadas /$batch de
+        # 20 subpeticiones en lugar de un GET por mensaje.
+        urls = [f"/me/messages/{msg.get('id')}/attachments"
+                "?$select=name,contentType,contentBytes,size" for msg in statements_data]
+        attachments_by_msg = _batch_get(headers, urls)
+
+        # Tabla de despacho construida una vez: un solo escaneo del nombre
+        # por parser en lugar de tres `in` encadenados por adjunto.
+        bank_parsers = (('TARJETA', parse_credit_card_statement),
+                        ('CTA', parse_savings_statement),
+                        ('CREDITO', parse_credit_statement))
+
+        def parse_statement(attachments):
+            if not attachments:
+                return None
+            for attachment in attachments.get('value', []):
+                name = attachment.get('name', '')
+                encoded = attachment.get('contentBytes')
+                if not encoded or not name.lower().endswith('.pdf'):
+                    continue
+                # pdfplumber acepta objetos file-like, así que los bytes
+                # decodificados no pasan por /tmp.
+                data = io.BytesIO(decode_attachment_bytes(encoded))
+                for tag, parser in bank_parsers:
+                    if tag in name:
+                        return parser(data, PDF_PASSWORD)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = executor.map(parse_statement, attachments_by_msg)
+        bank_statements = [info for info in results if info]
+
+        outputBlob.set(orjson.dumps(bank_statements).decode())
+        logging.info(f"Extraídos {len(bank_statements)} extractos.")
+    except Exception as e:
+        logging.error(f"Error procesando extractos: {str(e)}")
@@ -0,0 +1,20 @@
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+# Sesión compartida hacia Microsoft Graph: mantiene viva la conexión TLS
+# entre llamadas (y entre invocaciones mientras el worker esté caliente) y
+# reintenta automáticamente los códigos de throttling de Graph.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=32,
+    # POST entra en allowed_methods porque el único POST de la sesión es
+    # /$batch, un envoltorio idempotente de GETs: sin esto urllib3 no
+    # reintenta el 429 de la llamada de lote.
+    max_retries=Retry(total=3, backoff_factor=0.2,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset({'GET', 'POST'}))))
+SESSION.headers.update({'Accept-Encoding': 'gzip', 'Accept': 'application/json'})
+
+# (connect, read) en segundos para todas las llamadas a Graph.
+REQUEST_TIMEOUT = (3, 30)
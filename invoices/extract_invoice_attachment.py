@@ -1,12 +1,13 @@
 import azure.functions as func
 import logging
 from typing import Dict, List, Optional, Any, Union
+import io
 import zipfile
-import xmltodict
-from PyPDF2 import PdfReader
+from lxml import etree
 import fitz
 import requests
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+from graph_client import SESSION, REQUEST_TIMEOUT
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,10 +15,19 @@ logger = logging.getLogger(__name__)
 
 INVOICE_INFO = {"Total", "Date"}
 
+# Algunos extractores emiten 'value' en vez de 'Total'; se canonizan las
+# claves al mezclar para que el corte temprano de la cadena sí dispare.
+_KEY_ALIASES = {"value": "Total"}
+
 # Constants
 ENEL_MESSAGE_TEXT = "¡Con la factura virtual tienes toda la información al alcance de tu mano!"
 GRAPH_API_BASE_URL = "https://graph.microsoft.com/v1.0/me/messages"
 
+# Compiled once: finds the marker span and the two spans that follow it
+# (total and date) in a single traversal of the document.
+_ENEL_SPANS_XPATH = etree.XPath(
+    "//span[contains(normalize-space(.), $t)]/following::span[position()<=2]")
+
 class InvoiceData:
     def __init__(self, period: str, products: List[Dict[str, Any]], discount: float, total: float):
         self.period = period
@@ -48,25 +58,22 @@ def extract_enel_invoice(email_id: str, headers: Dict[str, str]) -> Optional[Dic
 
     url = f"{GRAPH_API_BASE_URL}/{email_id}"
     try:
-        response = requests.get(url, headers=headers)
+        response = SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
 
         data = response.json()
         html_content = data.get('body', {}).get('content', '')
         subject = data.get('subject', 'No Subject')
 
-        soup = BeautifulSoup(html_content, 'html.parser')
         values = {'subject': subject, 'id': email_id}
 
-        # Find the specific span and extract total and date
-        target_span = soup.find('span', string=lambda x: x and ENEL_MESSAGE_TEXT in x)
-        if target_span:
-            total_span = target_span.find_next("span")
-            if total_span:
-                values['total'] = total_span.text.strip()
-                date_span = total_span.find_next("span")
-                if date_span:
-                    values['date'] = date_span.text.strip()
+        if html_content:
+            tree = lxml_html.fromstring(html_content)
+            spans = _ENEL_SPANS_XPATH(tree, t=ENEL_MESSAGE_TEXT)
+            if spans:
+                values['total'] = spans[0].text_content().strip()
+                if len(spans) > 1:
+                    values['date'] = spans[1].text_content().strip()
 
         return values
 
@@ -77,94 +84,103 @@ def extract_enel_invoice(email_id: str, headers: Dict[str, str]) -> Optional[Dic
         logger.error(f"Error parsing email {email_id}: {e}")
         return None
 
-def _extract_product_info(product: Dict[str, Any]) -> Dict[str, Any]:
-    """Helper function to extract product information from XML product dict."""
+def _extract_product_info(product) -> Dict[str, Any]:
+    """Helper function to extract product information from an InvoiceLine element."""
 
     logging.info("Extracting product information from XML")
     product_dict = {}
 
     # Extract product ID
-    product_id = product.get('cbc:ID')
-    if isinstance(product_id, dict):
-        product_id = product_id.get('#text')
     try:
-        product_dict['product_id'] = int(product_id)
+        product_dict['product_id'] = int(product.findtext('{*}ID'))
     except (ValueError, TypeError):
         raise ValueError("Invalid product ID in XML")
 
     # Extract other fields
     try:
-        product_dict['quantity'] = float(product['cbc:InvoicedQuantity']['#text'])
-        product_dict['subtotal'] = float(product['cbc:LineExtensionAmount']['#text'])
-        product_dict['description'] = product['cac:Item']['cbc:Description']
-        product_dict['price'] = float(product['cac:Price']['cbc:PriceAmount']['#text'])
-    except KeyError as e:
+        product_dict['quantity'] = float(product.findtext('{*}InvoicedQuantity'))
+        product_dict['subtotal'] = float(product.findtext('{*}LineExtensionAmount'))
+        product_dict['description'] = product.findtext('{*}Item/{*}Description')
+        product_dict['price'] = float(product.findtext('{*}Price/{*}PriceAmount'))
+    except (ValueError, TypeError) as e:
         raise ValueError(f"Missing required field in product: {e}")
 
     # Extract taxes
     product_dict['taxes'] = 0.0
-    tax_total = product.get('cac:TaxTotal')
-    if tax_total:
-        if isinstance(tax_total, list):
-            for tax in tax_total:
-                try:
-                    product_dict['taxes'] += float(tax['cac:TaxSubtotal']['cbc:TaxAmount']['#text'])
-                except (KeyError, ValueError):
-                    pass
-        else:
-            try:
-                product_dict['taxes'] = float(tax_total['cac:TaxSubtotal']['cbc:TaxAmount']['#text'])
-            except (KeyError, ValueError):
-                pass
+    for tax in product.findall('{*}TaxTotal'):
+        try:
+            product_dict['taxes'] += float(tax.findtext('{*}TaxSubtotal/{*}TaxAmount'))
+        except (ValueError, TypeError):
+            pass
 
     return product_dict
 
-def get_from_xml(xml_data: Dict[str, Any]) -> InvoiceData:
+def get_from_xml(xml_data: Union[bytes, str]) -> Dict[str, Any]:
     """
-    Parses invoice information from XML data.
+    Parses invoice information by streaming the raw UBL XML.
+
+    Solo se materializan los elementos que realmente se leen
+    (AuthorizationPeriod, InvoiceLine, LegalMonetaryTotal); el resto del
+    documento se descarta conforme se cierra, sin el dict completo de
+    xmltodict.
 
     Args:
-        xml_data: Parsed XML data as a dictionary.
+        xml_data: Raw XML bytes or string of the invoice document.
 
     Returns:
-        InvoiceData object with extracted information.
+        Dict with extracted invoice information.
 
     Raises:
         ValueError: If required fields are missing or invalid.
     """
     logging.info("Extracting invoice data from XML")
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode('utf-8')
+
+    period = None
+    products = []
+    discount = total = None
     try:
-        invoice = xml_data['Invoice']
-        period = invoice['ext:UBLExtensions']['ext:UBLExtension'][0]['ext:ExtensionContent']['sts:DianExtensions']['sts:InvoiceControl']['sts:AuthorizationPeriod']
-
-        products = []
-        invoice_lines = invoice['cac:InvoiceLine']
-        if isinstance(invoice_lines, list):
-            for product in invoice_lines:
-                products.append(_extract_product_info(product))
-        elif isinstance(invoice_lines, dict):
-            products.append(_extract_product_info(invoice_lines))
-        else:
-            raise ValueError("Invalid invoice lines structure")
-
-        legal_monetary = invoice['cac:LegalMonetaryTotal']
-        discount = float(legal_monetary['cbc:AllowanceTotalAmount']['#text'])
-        total = float(legal_monetary['cbc:PayableAmount']['#text'])
-
-        return InvoiceData(period, products, discount, total).to_dict()
-    
-    except KeyError as e:
-        raise ValueError(f"Missing required XML field: {e}")
+        for _, el in etree.iterparse(
+                io.BytesIO(xml_data), events=('end',),
+                tag=('{*}AuthorizationPeriod', '{*}InvoiceLine', '{*}LegalMonetaryTotal')):
+            tag = etree.QName(el).localname
+            if tag == 'InvoiceLine':
+                products.append(_extract_product_info(el))
+            elif tag == 'AuthorizationPeriod':
+                # Las claves conservan el prefijo del documento (p.ej.
+                # 'cbc:StartDate'), igual que las emitía xmltodict: el
+                # dict del periodo se persiste tal cual en el blob.
+                period = {
+                    (f"{child.prefix}:{etree.QName(child).localname}"
+                     if child.prefix else etree.QName(child).localname): child.text
+                    for child in el}
+            else:
+                discount = float(el.findtext('{*}AllowanceTotalAmount'))
+                total = float(el.findtext('{*}PayableAmount'))
+            el.clear()
+    except etree.XMLSyntaxError as e:
+        raise ValueError(f"Invalid XML document: {e}")
     except (ValueError, TypeError) as e:
         raise ValueError(f"Invalid data in XML: {e}")
 
-def get_from_attachment(path_attachment: Optional[str] = None, path_xml: Optional[str] = None) -> InvoiceData:
+    if not products:
+        raise ValueError("Invalid invoice lines structure")
+    if total is None:
+        raise ValueError("Missing required XML field: LegalMonetaryTotal")
+
+    return InvoiceData(period, products, discount, total).to_dict()
+
+def get_from_attachment(path_attachment: Optional[str] = None, path_xml: Optional[str] = None,
+                        data: Optional[bytes] = None) -> InvoiceData:
     """
     Extracts invoice data from attachment or XML file.
 
     Args:
         path_attachment: Path to the zip attachment file.
         path_xml: Path to the XML file.
+        data: Raw zip bytes already decoded in memory, avoiding the disk
+            round trip.
 
     Returns:
         InvoiceData object.
@@ -174,18 +190,26 @@ def get_from_attachment(path_attachment: Optional[str] = None, path_xml: Optiona
     """
     logging.info("Extracting invoice data from attachment or XML file")
 
-    if path_attachment:
+    if path_attachment or data is not None:
         try:
-            with zipfile.ZipFile(path_attachment, 'r') as zip_file:
+            source = io.BytesIO(data) if data is not None else path_attachment
+            with zipfile.ZipFile(source, 'r') as zip_file:
                 files = zip_file.namelist()
                 xml_file = next((f for f in files if f.endswith('.xml')), None)
                 if not xml_file:
                     raise ValueError("No XML file found in zip attachment")
 
                 with zip_file.open(xml_file) as file:
-                    data = xmltodict.parse(file.read())
-                    xml_content = data['AttachedDocument']['cac:Attachment']['cac:ExternalReference']['cbc:Description']
-                    return get_from_xml(xmltodict.parse(xml_content))
+                    # iterparse extrae solo el texto de cbc:Description sin
+                    # materializar el dict del documento exterior completo.
+                    xml_content = None
+                    for _, el in etree.iterparse(file, tag='{*}Description'):
+                        xml_content = el.text
+                        el.clear()
+                        break
+                    if not xml_content:
+                        raise ValueError("No Description element found in XML")
+                    return get_from_xml(xml_content)
 
         except zipfile.BadZipFile:
             raise ValueError("Invalid zip file")
@@ -194,43 +218,42 @@ def get_from_attachment(path_attachment: Optional[str] = None, path_xml: Optiona
 
     elif path_xml:
         try:
-            with open(path_xml, 'r', encoding='utf-8') as file:
-                data = xmltodict.parse(file.read())
-                return get_from_xml(data)
+            with open(path_xml, 'rb') as file:
+                return get_from_xml(file.read())
         except FileNotFoundError:
             raise ValueError(f"XML file not found: {path_xml}")
         except Exception as e:
             raise ValueError(f"Error processing XML file: {e}")
     else:
-        raise ValueError("Either path_attachment or path_xml must be provided")
+        raise ValueError("Either path_attachment, path_xml or data must be provided")
+
+
+def _open_pdf(source, password: str) -> fitz.Document:
+    """Opens a PDF with fitz from a path or in-memory bytes and
+    authenticates it if encrypted."""
+    if isinstance(source, (bytes, bytearray)):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source)
+    if doc.is_encrypted:
+        if not password:
+            raise ValueError("Password required for encrypted PDF")
+        if not doc.authenticate(password):
+            raise ValueError("Invalid password for PDF")
+    return doc
 
 
-def _extract_alkosto_invoice(pdf_path: str, password: str) -> Dict[str, str]:
+def _extract_alkosto_invoice(text: str) -> Dict[str, str]:
     """
-    Extracts invoice information from an Alkosto PDF file.
+    Extracts invoice information from Alkosto PDF text.
     Args:
-        pdf_path: Path to the PDF file.
-        password: Password for encrypted PDFs.
+        text: Full text already extracted from the PDF.
     Returns:
         A dictionary with extracted invoice information.
     """
-
-    logging.info(f"Extracting Alkosto invoice from PDF: {pdf_path}")
-
-    reader = PdfReader(pdf_path)
     info = {}
-    if reader.is_encrypted:
-        if not password:
-            raise ValueError("Password required for encrypted PDF")
-        if not reader.decrypt(password):
-            raise ValueError("Invalid password for PDF")
-
-    all_text = ""
-    for page in reader.pages:
-        all_text += page.extract_text() + "\n"
-
     tip = 0
-    for line in all_text.split('\n'):
+    for line in text.splitlines():
         line = line.strip()
         if "REDEBAN" in line:
             clean_line = line.split("$")
@@ -238,68 +261,42 @@ def _extract_alkosto_invoice(pdf_path: str, password: str) -> Dict[str, str]:
         elif "ELECTRONICA" in line and tip == 0:
             tip += 1
         elif tip == 1 and len(line.split()) == 0:
-            tip +=1
+            tip += 1
         elif tip == 2:
             clean_line = line.split(" ")
             info['Date'] = clean_line[0].strip()
             tip = 0
+        if len(info) == 2:
+            return info
     return info
 
-def _extract_english_pdf(pdf_path, password):
-    reader = PdfReader(pdf_path)
-    info = {}
-    if reader.is_encrypted:
-        if not password:
-            raise ValueError("Password required for encrypted PDF")
-        if not reader.decrypt(password):
-            raise ValueError("Invalid password for PDF")
-
-    all_text = ""
-    for page in reader.pages:
-        all_text += page.extract_text() + "\n"
 
-    tip = 1
-    for line in all_text.split('\n'):
+def _extract_english_pdf(text: str) -> Dict[str, str]:
+    info = {}
+    for line in text.splitlines():
         cleaned_line = line.replace(' ', '').lower()
         if "total" in cleaned_line:
             if '$' in line:
                 info['value'] = line.split("$")[-1].replace(" ", "")
-        elif 'due' in line.replace(" ", "").lower() and tip == 1:
+        elif 'due' in cleaned_line:
             clean_line = line.replace(" ", "").split("due")
             if clean_line[0] == 'Date':
                 info['Date'] = clean_line[-1].replace(":", '')
-                tipo = 0
+        if len(info) == 2:
+            return info
+    return {}
 
-    if len(info) == 2:
-        return info
-    else:
-        return {}
 
-def _extract_with_pypdf2(pdf_path, password):
+def _extract_generic_invoice(text: str) -> Dict[str, str]:
     """
-    Function to extract invoice information from a PDF using PyPDF2.
+    Function to extract invoice information from generic PDF text.
     Args:
-        pdf_path: Path to the PDF file.
-        password: Password for encrypted PDFs.
+        text: Full text already extracted from the PDF.
     Returns:
         A dictionary with extracted invoice information.
     """
-
-    logging.info(f"Extracting invoice from PDF using PyPDF2: {pdf_path}")
-
     info = {}
-    reader = PdfReader(pdf_path)
-    if reader.is_encrypted:
-        if not password:
-            raise ValueError("Password required for encrypted PDF")
-        if not reader.decrypt(password):
-            raise ValueError("Invalid password for PDF")
-
-    all_text = ""
-    for page in reader.pages:
-        all_text += page.extract_text() + "\n"
-
-    for line in all_text.split('\n'):
+    for line in text.splitlines():
         line = line.strip()
         if "total" in line.lower():
             clean_line = line.split(' ')
@@ -318,21 +315,9 @@ def _extract_with_pypdf2(pdf_path, password):
             return info
     return {}
 
-def _extract_with_fitz(pdf_path, password):
-    logging.info(f"Extracting invoice from PDF using fitz: {pdf_path}")
 
-    doc = fitz.open(pdf_path)
-    if doc.is_encrypted:
-        if not password:
-            raise ValueError("Password required for encrypted PDF")
-        if not doc.authenticate(password):
-            raise ValueError("Invalid password for PDF")
-
-    all_text = ""
-    for page in doc:
-        all_text += page.get_text() + "\n"
-
-    for line in all_text.split('\n'):
+def _extract_first_match(text: str) -> Dict[str, str]:
+    for line in text.splitlines():
         cleaned_line = line.replace(' ', '').lower()
         if "total" in cleaned_line and '$' in line:
             value = line.split("$")[-1].strip()
@@ -345,24 +330,34 @@ def _extract_with_fitz(pdf_path, password):
     return {}
 
 
-def extract_invoice_from_pdf(pdf_path: str, password: Optional[str] = None) -> Optional[List[str]]:
+def extract_invoice_from_pdf(pdf_path: Union[str, bytes], password: Optional[str] = None) -> Optional[List[str]]:
     """
     Extracts invoice information from a PDF file.
 
+    The document is opened and decrypted once and its text cached, so the
+    extractor chain scans the same string instead of re-parsing (and
+    re-decrypting) the PDF per extractor.
+
     Args:
-        pdf_path: Path to the PDF file.
+        pdf_path: Path to the PDF file, or the raw PDF bytes in memory.
         password: Optional password for encrypted PDFs.
 
     Returns:
         List of strings containing total information, or None if not found.
     """
+    doc = _open_pdf(pdf_path, password)
+    try:
+        text = "\n".join(page.get_text("text") for page in doc)
+    finally:
+        doc.close()
+
     info = {}
 
     extractors = [
-        lambda: _extract_with_fitz(pdf_path, password),
-        lambda: _extract_with_pypdf2(pdf_path, password),
-        lambda: _extract_alkosto_invoice(pdf_path, password),
-        lambda: _extract_english_pdf(pdf_path, password)
+        lambda: _extract_first_match(text),
+        lambda: _extract_generic_invoice(text),
+        lambda: _extract_alkosto_invoice(text),
+        lambda: _extract_english_pdf(text)
     ]
 
     for extractor in extractors:
@@ -370,11 +365,12 @@ def extract_invoice_from_pdf(pdf_path: str, password: Optional[str] = None) -> O
             update = extractor()
 
             for key, value in update.items():
+                key = _KEY_ALIASES.get(key, key)
                 if value is not None and info.get(key) is None:
                     info[key] = value
-            if all(info.get(key) is not None for key in INVOICE_INFO if key != 'state'):
+            if all(info.get(key) is not None for key in INVOICE_INFO):
                 break
         except Exception as e:
             logger.error(f"Error in extractor: {e}")
 
-    return info
\ No newline at end of file
+    return info
@@ -1,7 +1,9 @@
 import azure.functions as func
 import requests
-from invoices.decode_attachment import decode_and_save_attachment
+from graph_client import SESSION, REQUEST_TIMEOUT
+from invoices.decode_attachment import decode_attachment_bytes
 from invoices.extract_invoice_attachment import get_from_attachment, extract_invoice_from_pdf
+from keys import PDF_PASSWORD
 import pandas as pd
 import logging
 
@@ -9,29 +11,31 @@ logging.basicConfig(level=logging.INFO)
 
 def extract_invoice(id: str, headers: dict):
     """
-    Extract data from invoices emails, depend of the electronic invoice, if have a PDF file, or 
+    Extract data from invoices emails, depend of the electronic invoice, if have a PDF file, or
     a zip file
     """
     logging.info(f"Extracting invoice from email with id: {id}")
 
-    path = f"https://graph.microsoft.com/v1.0/me/messages/{id}/attachments"
-    response = requests.get(path, headers=headers)
+    path = (f"https://graph.microsoft.com/v1.0/me/messages/{id}/attachments"
+            "?$select=name,contentType,contentBytes,size")
+    response = SESSION.get(path, headers=headers, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
-        
-        attachments = response.json()['value']
-        
-        for attachment in attachments:
-            attachment_name = attachment['name']
-            attachment_encode = attachment['contentBytes']
-            if (attachment['contentType'] == "application/zip" or attachment['contentType'] == "application/octet-stream") and attachment_name[-3:] == "zip":
-                path_attachment = "/tmp/" + attachment_name
-                decode_and_save_attachment(attachment_encode, path_attachment)
-                info = get_from_attachment(path_attachment=path_attachment)
-                return info
-            elif (attachment['contentType'] == 'application/pdf' or attachment['contentType'] == "application/octet-stream") and attachment_name[-3:] == "pdf":
-                path_attachment = "/tmp/" + attachment_name
-                decode_and_save_attachment(attachment_encode, path_attachment)
-                password = "1026291584" # the password is  temporally None, but in other cases is the Identification of user
-                info = extract_invoice_from_pdf(path_attachment, password)
-            
-                return info
\ No newline at end of file
+        return extract_invoice_from_attachments(response.json()['value'])
+
+
+def extract_invoice_from_attachments(attachments: list):
+    """
+    Extract invoice data from an already fetched Graph attachments list,
+    so callers can batch the HTTP round trips.
+    """
+    for attachment in attachments:
+        attachment_name = attachment['name']
+        attachment_encode = attachment['contentBytes']
+        if (attachment['contentType'] == "application/zip" or attachment['contentType'] == "application/octet-stream") and attachment_name[-3:] == "zip":
+            info = get_from_attachment(data=decode_attachment_bytes(attachment_encode))
+            return info
+        elif (attachment['contentType'] == 'application/pdf' or attachment['contentType'] == "application/octet-stream") and attachment_name[-3:] == "pdf":
+            # the password is temporally None, but in other cases is the Identification of user
+            info = extract_invoice_from_pdf(decode_attachment_bytes(attachment_encode), PDF_PASSWORD)
+
+            return info
\ No newline at end of file
@@ -5,6 +5,31 @@ import json
 import re
 from typing import Dict, Any
 
+# Compiled once at import so each notification doesn't recompile it
+_AMOUNT_PATTERN = re.compile(r'\$([0-9.,]+)')
+
+# Un regex compilado por tipo de proceso reemplaza las máquinas de
+# estados token a token: cada cuerpo se resuelve en una pasada dentro
+# del motor de re en C, con los mismos límites de campo que antes
+# (where hasta 'con', with hasta 'el', etc.).
+_PROCESS_PATTERNS = {
+    'Compraste': re.compile(
+        r"Compraste\s+(?:\S+\s+){2}(?P<where>.+?)\s+con\s+tu\s+"
+        r"(?P<with>.+?)\s+el\s+(?P<date>\S+)", re.IGNORECASE),
+    'Transferiste': re.compile(
+        r"Transferiste\s+(?:\S+\s+){3}(?P<from>\S+\s+\S+)\s+(?:\S+\s+){2}"
+        r"(?P<to>\S+\s+\S+)\s+\S+\s+(?P<date>\S+)", re.IGNORECASE),
+    'Pagaste': re.compile(
+        r"Pagaste\s+(?:\S+\s+){2}(?P<to>.+?)\s+desde\b.*?\bproducto\s+"
+        r"(?P<with>\S+).*?\bel\s+(?P<date>\S+)", re.IGNORECASE | re.DOTALL),
+    'Recibiste': re.compile(
+        r"Recibiste\s+(?:\S+\s+){5}(?P<from>.+?)\s+en\s+tu\s+"
+        r"(?P<with>.+?)\s+el\s+(?P<date>\S+)", re.IGNORECASE),
+    'Retiraste': re.compile(
+        r"Retiraste\s+(?:\S+\s+){2}(?P<where>.+?)\s+de\s+tu\s+"
+        r"(?P<with>.+?)\s+el\s+(?P<date>\S+)", re.IGNORECASE),
+}
+
 def extract_notification_email(body_preview: str) -> Dict[str, Any]:
     """
     Extracts notification details from email body preview.
@@ -18,108 +43,20 @@ def extract_notification_email(body_preview: str) -> Dict[str, Any]:
     info = {'process': process}
 
     # Extract value using regex for consistency
-    amount_match = re.search(r'\$([0-9.,]+)', body_preview)
+    amount_match = _AMOUNT_PATTERN.search(body_preview)
     if amount_match:
         value_str = amount_match.group(1).replace('.', '').replace(',', '')
         info['value'] = value_str
 
     # Extract other fields based on process type
-    if process == 'Compraste':
-        idx_wh = 0
-        whe = ''
-        for idx, val in enumerate(lines):
-            if idx == 3:
-                idx_wh += 1
-            elif idx_wh == 1 and val.lower() == 'con':
-                info['where'] = whe.strip()
-                whe = ''
-                idx_wh += 1
-            elif idx_wh == 1:
-                whe += val + " "
-            elif idx_wh == 2 and val.lower() == 'tu':
-                idx_wh += 1
-            elif idx_wh == 3 and val.lower().strip() != 'el':
-                whe += val + " "
-            elif idx_wh == 3 and val.lower().strip() == 'el':
-                info['with'] = whe.strip().replace(',', '')
-                whe = ''
-                idx_wh += 1
-            elif idx_wh == 4:
-                info['date'] = val
-                break
-
-    elif process == 'Transferiste':
-        if len(lines) > 12:
-            info['from'] = f"{lines[5]} {lines[6]}"
-            info['to'] = f"{lines[9]} {lines[10]}"
-            info['date'] = lines[12]
-
-    elif process == 'Pagaste':
-        idx_wh = 0
-        whe = ''
-        for idx, line in enumerate(lines[2:], 2):
-            if idx >= 4 and line != 'desde' and idx_wh == 0:
-                whe += line + " "
-            elif idx >= 4 and line == 'desde':
-                info['to'] = whe.strip()
-                whe = ''
-                idx_wh = 1
-            elif line.lower() == 'producto' and idx_wh == 1:
-                idx_wh = 2
-            elif idx_wh == 2:
-                info['with'] = line.strip()
-                idx_wh = 3
-            elif line.lower() == 'el' and idx_wh == 3:
-                idx_wh = 4
-            elif idx_wh == 4:
-                info['date'] = line
-                break
-
-    elif process == 'Recibiste':
-        idx_wh = 0
-        whe = ''
-        for idx, line in enumerate(lines[5:], 5):
-            if idx >= 7 and line != 'en' and idx_wh == 0:
-                whe += line + " "
-            elif idx >= 7 and line == 'en':
-                info['from'] = whe.strip()
-                whe = ''
-                idx_wh = 1
-            elif line.lower() == 'tu' and idx_wh == 1:
-                idx_wh = 2
-            elif idx_wh == 2:
-                if line.lower() == 'el':
-                    info['with'] = whe.strip()
-                    whe = ''
-                    idx_wh = 3
-                else:
-                    whe += line + " "
-            elif idx_wh == 3:
-                info['date'] = line
-                break
-
-    elif process == 'Retiraste':
-        idx_wh = 0
-        whe = ''
-        for idx, line in enumerate(lines[2:], 2):
-            if idx >= 4 and line != 'de' and idx_wh == 0:
-                whe += line + " "
-            elif idx >= 4 and line == 'de':
-                info['where'] = whe.strip()
-                whe = ''
-                idx_wh = 1
-            elif idx_wh == 1 and line.lower() == 'tu':
-                idx_wh = 2
-            elif idx_wh == 2:
-                if line.lower() == 'el':
-                    info['with'] = whe.strip()
-                    whe = ''
-                    idx_wh = 3
-                else:
-                    whe += line + " "
-            elif idx_wh == 3:
-                info['date'] = line
-                break
+    pattern = _PROCESS_PATTERNS.get(process)
+    if pattern:
+        match = pattern.search(" ".join(lines))
+        if match:
+            fields = {key: value for key, value in match.groupdict().items() if value}
+            if process == 'Compraste' and 'with' in fields:
+                fields['with'] = fields['with'].replace(',', '')
+            info.update(fields)
 
     return info
 
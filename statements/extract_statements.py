@@ -1,9 +1,10 @@
 import requests
 import re
+import ahocorasick
 import pdfplumber
 import logging
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+from typing import Iterable, Iterator, List, Dict, Any, Optional
 #from decode_attachment import decode_and_save_attachment
 
 # Configure logging
@@ -12,12 +13,54 @@ logger = logging.getLogger(__name__)
 
 # Constants
 CREDIT_CARD_PATTERN = re.compile(
-    r"(\d{6})\s+(\d{2}/\d{2}/\d{4})\s+(.*?)\s+([\d,.]+)\s+([\d,.]+)\s+([\d,.]+)\s+([\d,.]+-?)\s+([\d,.]+)\s+([\d/]+)"
+    r"(\d{6})\s+(\d{2}/\d{2}/\d{4})\s+(.*?)\s+([\d,.]+)\s+([\d,.]+)\s+([\d,.]+)\s+([\d,.]+-?)\s+([\d,.]+)\s+([\d/]+)",
+    re.ASCII,
 )
-SAVINGS_LINE_PATTERN = re.compile(r"(\d{1,2}/\d{2})\s+(.*?)\s+([\d,.-]+)\s+([\d,.-]+)")
-SAVINGS_SUMMARY_PATTERN = re.compile(r"([A-ZÁÉÍÓÚÑ ]+)\s+\$\s+([\d,.]+)")
-
-@dataclass
+# Guardia barata: solo las líneas que arrancan con la autorización de
+# seis dígitos pagan el regex completo de transacción.
+CREDIT_CARD_PREFIX = re.compile(r"^\s*\d{6}\s", re.ASCII)
+SAVINGS_LINE_PATTERN = re.compile(r"(\d{1,2}/\d{2})\s+(.*?)\s+([\d,.-]+)\s+([\d,.-]+)", re.ASCII)
+SAVINGS_SUMMARY_PATTERN = re.compile(r"([A-ZÁÉÍÓÚÑ ]+)\s+\$\s+([\d,.]+)", re.ASCII)
+# Exige un dígito inicial, así los separadores sueltos nunca llegan a la
+# lista y no hace falta filtrarlos después.
+NUMBERS_PATTERN = re.compile(r"\d[\d,.]*", re.ASCII)
+
+# Campos del resumen de tarjeta: (subcadena, destino, nombre, bandera).
+# La tupla vive a nivel de módulo en vez de reconstruirse por línea, y la
+# alternación compilada sirve de guardia: una sola pasada en C decide si
+# la línea contiene algún campo antes de entrar al lazo de 14 entradas.
+SUMMARY_FIELDS = (
+    ("saldo anterior", 'total', 'Saldo Anterior', None),
+    ("compras del mes", 'total', 'Compras del mes', None),
+    ("intereses de mora", 'total', 'Intereses de mora', 'long_interes'),
+    ("intereses de mora", 'minimum', 'Intereses de mora', 'long_interes'),
+    ("intereses corrientes", 'total', 'Intereses corrientes', 'interes_corriente'),
+    ("intereses corrientes", 'minimum', 'Intereses corrientes', 'interes_corriente'),
+    ("avances", 'total', 'Avances', None),
+    ("cuota avances", 'minimum', 'Cuota avances', None),
+    ("otros cargos", 'total', 'Otros cargos', 'other_charges'),
+    ("otros cargos", 'minimum', 'Otros cargos', 'other_charges'),
+    ("pagos / abonos", 'total', 'Pagos / abonos', None),
+    ("cuota compras anteriores", 'minimum', 'Cuota compras anteriores', None),
+    ("cuota compras del mes", 'minimum', 'Cuota compras del mes', None),
+    ("saldo en mora", 'minimum', 'Saldo en mora', None),
+)
+SUMMARY_FIELDS_GUARD = re.compile(
+    "|".join(sorted({re.escape(field[0]) for field in SUMMARY_FIELDS},
+                    key=len, reverse=True)))
+
+# Clases de columna del camino rápido de transacciones, espejo de los
+# grupos del patrón de tarjeta.
+_NUM_CHARS = frozenset("0123456789,.")
+_CUOTAS_CHARS = frozenset("0123456789/")
+_CC_DATE_PATTERN = re.compile(r"\d{2}/\d{2}/\d{4}$", re.ASCII)
+
+# Cabecera que abre la sección de intereses. El token corto descarta la
+# línea antes de comparar la cadena completa de 45 caracteres.
+_INTEREST_HEADER_TOKEN = "facturadacargos"
+_INTEREST_HEADER = "facturadacargos y abonos saldo a diferir cuotas"
+
+@dataclass(slots=True)
 class CreditCardRecord:
     autorizacion: str
     fecha: str
@@ -29,14 +72,14 @@ class CreditCardRecord:
     saldo_diferir: float
     cuotas: str
 
-@dataclass
+@dataclass(slots=True)
 class SavingsRecord:
     fecha: str
     descripcion: str
     valor: float
     saldo: float
 
-@dataclass
+@dataclass(slots=True)
 class InterestRecord:
     fecha: str
     descripcion: str
@@ -44,45 +87,66 @@ class InterestRecord:
     cargos_abonos: float
     saldo_diferir: float
 
+# Separadores y signo se eliminan en una sola pasada en C; el signo se
+# decide aparte para respetar el menos al final ("1,000-").
+_FLOAT_DEL_TABLE = str.maketrans("", "", ",-")
+
 def safe_float(value: str) -> float:
     """Safely convert string to float, handling commas and negatives."""
     try:
-        cleaned = value.replace(",", "").replace("-", "")
-        return -float(cleaned) if "-" in value else float(cleaned)
+        cleaned = float(value.translate(_FLOAT_DEL_TABLE))
+        return -cleaned if "-" in value else cleaned
     except ValueError:
         logger.warning(f"Could not convert '{value}' to float")
         return 0.0
 
 def extract_numbers(line: str) -> List[str]:
-    numbers = re.findall(r"[\d,.]+", line)
-    numbers = [x for x in numbers if x != "," and x != "."]
-    return numbers
-
-def parse_credit_card_lines(text_lines: List[str]) -> List[CreditCardRecord]:
-    """Parse credit card transaction lines."""
+    return NUMBERS_PATTERN.findall(line)
+
+def iter_pdf_lines(pdf) -> Iterator[str]:
+    """Genera las líneas de texto del PDF página a página, sin acumular
+    el texto del documento completo.
+
+    Las páginas sin caracteres (publicidad, hojas en blanco al final) se
+    descartan antes de pagar el análisis de layout de extract_text."""
+    for page in pdf.pages:
+        if not page.chars:
+            continue
+        text = page.extract_text()
+        if text:
+            yield from text.splitlines()
+
+def _fast_credit_card_fields(stripped: str) -> Optional[List[str]]:
+    """Camino rápido sin regex para la línea de transacción bien formada.
+
+    Una línea de nueve columnas separadas por espacios simples se valida
+    con pruebas de str a velocidad de C; cualquier desviación
+    (descripción de varias palabras, espacios dobles, columnas raras)
+    devuelve None y la decide el patrón completo, de modo que la
+    asignación siempre coincide con la del regex."""
+    if "  " in stripped or "\t" in stripped:
+        return None
+    parts = stripped.split(" ")
+    if len(parts) != 9:
+        return None
+    cargos = parts[6]
+    if cargos.endswith("-"):
+        cargos = cargos[:-1]
+    if not (len(parts[0]) == 6 and parts[0].isdigit()
+            and _CC_DATE_PATTERN.match(parts[1])
+            and all(p and set(p) <= _NUM_CHARS
+                    for p in (parts[3], parts[4], parts[5], cargos, parts[7]))
+            and parts[8] and set(parts[8]) <= _CUOTAS_CHARS):
+        return None
+    return parts
+
+def parse_credit_card(text_lines: List[str]) -> Dict[str, Any]:
+    """Parse credit card summary and transaction lines in a single pass.
+
+    El resumen necesita mirar la línea siguiente, así que se recibe la
+    lista, pero resumen y transacciones se resuelven en el mismo
+    recorrido en vez de caminarla dos veces."""
     records = []
-    for line in text_lines:
-        match = CREDIT_CARD_PATTERN.match(line.strip())
-        if match:
-            try:
-                record = CreditCardRecord(
-                    autorizacion=match.group(1),
-                    fecha=match.group(2),
-                    descripcion=match.group(3).strip(),
-                    valor_original=safe_float(match.group(4)),
-                    tasa_pactada=match.group(5),
-                    tasa_ea=match.group(6),
-                    cargos_abonos=safe_float(match.group(7)),
-                    saldo_diferir=safe_float(match.group(8)),
-                    cuotas=match.group(9),
-                )
-                records.append(record)
-            except Exception as e:
-                logger.error(f"Error parsing credit card line: {line}\n{e}")
-    return records
-
-def parse_credit_card_summary(text_lines: List[str]) -> Dict[str, Any]:
-    """Parse credit card summary information."""
     summary = {}
     total = {}
     minimum = {}
@@ -94,8 +158,31 @@ def parse_credit_card_summary(text_lines: List[str]) -> Dict[str, Any]:
         'interest_payment': False,
         'service_fee': False,
     }
+    targets = {'total': total, 'minimum': minimum}
 
     for index, line in enumerate(text_lines):
+        fields = None
+        if CREDIT_CARD_PREFIX.match(line):
+            stripped = line.strip()
+            fields = _fast_credit_card_fields(stripped)
+            if fields is None and (match := CREDIT_CARD_PATTERN.match(stripped)):
+                fields = match.groups()
+        if fields:
+            try:
+                records.append(CreditCardRecord(
+                    autorizacion=fields[0],
+                    fecha=fields[1],
+                    descripcion=fields[2].strip(),
+                    valor_original=safe_float(fields[3]),
+                    tasa_pactada=fields[4],
+                    tasa_ea=fields[5],
+                    cargos_abonos=safe_float(fields[6]),
+                    saldo_diferir=safe_float(fields[7]),
+                    cuotas=fields[8],
+                ))
+            except Exception as e:
+                logger.error(f"Error parsing credit card line: {line}\n{e}")
+
         lower_line = line.lower()
 
         if "cupo total" in lower_line and index + 1 < len(text_lines):
@@ -120,8 +207,7 @@ def parse_credit_card_summary(text_lines: List[str]) -> Dict[str, Any]:
             flags['interest_payment'] = False
             flags['service_fee'] = True
 
-        elif flags['service_fee'] and len(lower_line.split()) == 8:
-            parts = lower_line.split()
+        elif flags['service_fee'] and len(parts := lower_line.split()) == 8:
             record = InterestRecord(
                 fecha=parts[1],
                 descripcion=f"{parts[2]} {parts[3]} {parts[4]}",
@@ -139,40 +225,22 @@ def parse_credit_card_summary(text_lines: List[str]) -> Dict[str, Any]:
                 summary['pay before'] = values[4]
 
         # Summary fields with flags
-        summary_fields = [
-            ("saldo anterior", total, 'Saldo Anterior', None),
-            ("compras del mes", total, 'Compras del mes', None),
-            ("intereses de mora", total, 'Intereses de mora', 'long_interes'),
-            ("intereses de mora", minimum, 'Intereses de mora', 'long_interes'),
-            ("intereses corrientes", total, 'Intereses corrientes', 'interes_corriente'),
-            ("intereses corrientes", minimum, 'Intereses corrientes', 'interes_corriente'),
-            ("avances", total, 'Avances', None),
-            ("cuota avances", minimum, 'Cuota avances', None),
-            ("otros cargos", total, 'Otros cargos', 'other_charges'),
-            ("otros cargos", minimum, 'Otros cargos', 'other_charges'),
-            ("pagos / abonos", total, 'Pagos / abonos', None),
-            ("cuota compras anteriores", minimum, 'Cuota compras anteriores', None),
-            ("cuota compras del mes", minimum, 'Cuota compras del mes', None),
-            ("saldo en mora", minimum, 'Saldo en mora', None),
-        ]
-
-
-        for field in summary_fields:
-            key, target, name = field[0], field[1], field[2]
-            flag_key = field[3] if len(field) > 3 else None
-            if key in lower_line:
-                numbers = extract_numbers(line)
-                if numbers:
-                    if flag_key and flags[flag_key] == 0:
-                        target[name] = safe_float(numbers[0])
-                        flags[flag_key] = 1
-                    elif flag_key and flags[flag_key] == 1:
-                        target[name] = safe_float(numbers[0])
-                        flags[flag_key] = 0
-                    elif not flag_key:
-                        target[name] = safe_float(numbers[0])
-
-        if "facturadacargos y abonos saldo a diferir cuotas" in lower_line:
+        if SUMMARY_FIELDS_GUARD.search(lower_line):
+            for key, target_name, name, flag_key in SUMMARY_FIELDS:
+                if key in lower_line:
+                    target = targets[target_name]
+                    numbers = extract_numbers(line)
+                    if numbers:
+                        if flag_key and flags[flag_key] == 0:
+                            target[name] = safe_float(numbers[0])
+                            flags[flag_key] = 1
+                        elif flag_key and flags[flag_key] == 1:
+                            target[name] = safe_float(numbers[0])
+                            flags[flag_key] = 0
+                        elif not flag_key:
+                            target[name] = safe_float(numbers[0])
+
+        if _INTEREST_HEADER_TOKEN in lower_line and _INTEREST_HEADER in lower_line:
             flags['interest_payment'] = True
 
     return {
@@ -180,20 +248,16 @@ def parse_credit_card_summary(text_lines: List[str]) -> Dict[str, Any]:
         'total': total,
         'minimum': minimum,
         'other_lines': other_lines,
+        'records': records,
     }
 
 def parse_credit_card_statement(pdf_path: str, password: str) -> Dict[str, Any]:
     """Parse credit card statement from PDF."""
     try:
         with pdfplumber.open(pdf_path, password=password) as pdf:
-            text_lines = []
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    text_lines.extend(text.splitlines())
+            text_lines = list(iter_pdf_lines(pdf))
 
-        summary_data = parse_credit_card_summary(text_lines)
-        statement_lines = parse_credit_card_lines(text_lines)
+        summary_data = parse_credit_card(text_lines)
 
         return {
             'Cupo Total': summary_data['summary'].get('Cupo Total'),
@@ -205,47 +269,70 @@ def parse_credit_card_statement(pdf_path: str, password: str) -> Dict[str, Any]:
             'pay before': summary_data['summary'].get('pay before'),
             'summary_statement_total': summary_data['total'],
             'summary_statement_minimum': summary_data['minimum'],
-            'Statement_lines': summary_data['other_lines'] + statement_lines,
+            'Statement_lines': summary_data['other_lines'] + summary_data['records'],
             'type': 'Credit Card',
         }
     except Exception as e:
         logger.error(f"Error parsing credit card PDF {pdf_path}: {e}")
         return {}
 
+# Conceptos del resumen del crédito, con el espacio final tal como
+# aparecen en la línea. Igual que el clasificador de mensajes, van en un
+# automaton que busca los ocho en un único escaneo lineal por línea.
+SUMMARY_CONCEPTS = ("ABONO A CAPITAL ", "INTERÉS CORRIENTE ", "INTERÉS MORA ",
+        "SEGURO VIDA ", "OTROS CONCEPTOS ", "COMISIÓN FNG/FAG ",
+        "IVA FNG/FAG ", "TOTAL ")
+
+def _build_summary_automaton() -> ahocorasick.Automaton:
+    automaton = ahocorasick.Automaton()
+    for concept in SUMMARY_CONCEPTS:
+        automaton.add_word(concept, concept)
+    automaton.make_automaton()
+    return automaton
+
+_SUMMARY_AUTOMATON = _build_summary_automaton()
+
 def parse_summary_credit(text_lines: List[str]) -> Dict[str, Any]:
     summary = {}
-    concepts = ["ABONO A CAPITAL ", "INTERÉS CORRIENTE ", "INTERÉS MORA ", \
-            "SEGURO VIDA ", "OTROS CONCEPTOS ", "COMISIÓN FNG/FAG ", \
-            "IVA FNG/FAG ", "TOTAL "]
-    
     for line in text_lines:
-        new_line = line.split(" ")
-        concept = ""
-        for idx, val in enumerate(new_line):
-            concept += val + " "
-            if concept in concepts:
-                summary[concept[:-1]] = {"previous_payment": new_line[idx + 1]}
-                if idx + 2 > len(new_line) - 1:
-                    summary[concept[:-1]]["payment"] = 0
-                else:
-                    summary[concept[:-1]]["payment"] = new_line[idx + 2]
+        for end_idx, concept in _SUMMARY_AUTOMATON.iter(line):
+            # Solo valen los conceptos al inicio de la línea, como en el
+            # lazo de prefijos original (p.ej. "TOTAL " no debe disparar
+            # dentro de "SUBTOTAL ").
+            if end_idx != len(concept) - 1:
+                continue
+            new_line = line.split(" ")
+            idx = concept.count(" ") - 1
+            summary[concept[:-1]] = {"previous_payment": new_line[idx + 1]}
+            if idx + 2 > len(new_line) - 1:
+                summary[concept[:-1]]["payment"] = 0
+            else:
+                summary[concept[:-1]]["payment"] = new_line[idx + 2]
     return summary
 
+# Conceptos de la hoja de crédito; el frozenset da membresía O(1) y el
+# máximo de palabras acota el lazo de sufijos por línea.
+CREDIT_CONCEPTS = ("FECHA DE DESEMBOLSO", "VALOR INICIAL", "FECHA CORTE EXTRACTO",
+        "SALDO DE CAPITAL", "TASA DE INTERÉS E.A.", "CUOTA NÚMERO",
+        "TASA MORA A LA FECHA", "SALDO EN MORA CAPITAL",
+        "Nº DE CUOTAS EN MORA", "FECHA ÚLTIMO PAGO", "MORA DESDE")
+_CREDIT_CONCEPT_SET = frozenset(CREDIT_CONCEPTS)
+_MAX_CONCEPT_WORDS = max(c.count(" ") for c in CREDIT_CONCEPTS) + 1
+
 def parse_credit_information(text_lines: List[str]) -> Dict[str, Any]:
     credit_information = {}
-    concepts = ["FECHA DE DESEMBOLSO", "VALOR INICIAL", "FECHA CORTE EXTRACTO", 
-            "SALDO DE CAPITAL", "TASA DE INTERÉS E.A.", "CUOTA NÚMERO",
-            "TASA MORA A LA FECHA", "SALDO EN MORA CAPITAL",
-            "Nº DE CUOTAS EN MORA", "FECHA ÚLTIMO PAGO", "MORA DESDE"]
     for line in text_lines:
-        new_line = line.split(" ")
+        tokens = line.split(" ")
+        # Solo se prueban sufijos de hasta _MAX_CONCEPT_WORDS palabras
+        # antes del valor final; el sufijo se acumula de forma
+        # incremental en vez de reconstruir el join en cada paso.
         concept = ""
-        for idx in range(len(new_line), -1, -1):
-            concept = " ".join(new_line[idx:-1])
-            if concept in concepts:
-                credit_information[concept] = new_line[-1]
-    
-    lacks = [key for key in concepts if key not in credit_information.keys()]
+        for k in range(1, min(_MAX_CONCEPT_WORDS, len(tokens) - 1) + 1):
+            concept = tokens[-k - 1] if k == 1 else f"{tokens[-k - 1]} {concept}"
+            if concept in _CREDIT_CONCEPT_SET:
+                credit_information[concept] = tokens[-1]
+
+    lacks = [key for key in CREDIT_CONCEPTS if key not in credit_information.keys()]
     for lack in lacks:
         credit_information[lack] = ''
 
@@ -254,12 +341,8 @@ def parse_credit_information(text_lines: List[str]) -> Dict[str, Any]:
 def parse_credit_statement(pdf_path: str, password: str) -> Dict[str, Any]:
     try:
         with pdfplumber.open(pdf_path, password=password) as pdf:
-            text_lines = []
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    text_lines.extend(text.splitlines())
-        
+            text_lines = list(iter_pdf_lines(pdf))
+
         summary = parse_summary_credit(text_lines)
         credit_information = parse_credit_information(text_lines)
         credit_statement = {"credit_information": credit_information,
@@ -278,16 +361,17 @@ def parse_credit_statement(pdf_path: str, password: str) -> Dict[str, Any]:
         return {}
 
 
-def parse_savings_lines(text_lines: List[str]) -> Dict[str, Any]:
+def parse_savings_lines(text_lines: Iterable[str]) -> Dict[str, Any]:
     """Parse savings account statement."""
     lines = []
     summary = {}
     statement_info = {}
 
+    # Los patrones se evalúan de forma perezosa: como máximo uno puede
+    # aplicar por línea, así que el de resumen solo corre cuando el de
+    # transacción falló, en vez de ejecutar ambos siempre.
     for line in text_lines:
         stripped = line.strip()
-        match_line = SAVINGS_LINE_PATTERN.match(stripped)
-        matches_summary = SAVINGS_SUMMARY_PATTERN.findall(stripped)
 
         if 'DESDE' in line:
             parts = line.split()
@@ -298,7 +382,7 @@ def parse_savings_lines(text_lines: List[str]) -> Dict[str, Any]:
             parts = line.split()
             if len(parts) >= 2:
                 statement_info['number'] = parts[1]
-        elif match_line:
+        elif (match_line := SAVINGS_LINE_PATTERN.match(stripped)):
             try:
                 record = SavingsRecord(
                     fecha=match_line.group(1),
@@ -309,7 +393,7 @@ def parse_savings_lines(text_lines: List[str]) -> Dict[str, Any]:
                 lines.append(record)
             except Exception as e:
                 logger.error(f"Error parsing savings line: {line}\n{e}")
-        elif matches_summary:
+        elif (matches_summary := SAVINGS_SUMMARY_PATTERN.findall(stripped)):
             try:
                 for campo, valor in matches_summary:
                     summary[campo.strip()] = safe_float(valor)
@@ -329,13 +413,9 @@ def parse_savings_statement(pdf_path: str, password: str) -> Dict[str, Any]:
     """Parse savings statement from PDF."""
     try:
         with pdfplumber.open(pdf_path, password=password) as pdf:
-            text_lines = []
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    text_lines.extend(text.splitlines())
-
-        return parse_savings_lines(text_lines)
+            # El parser de ahorros es de una sola pasada, así que consume
+            # el generador directamente sin materializar las líneas.
+            return parse_savings_lines(iter_pdf_lines(pdf))
     except Exception as e:
         logger.error(f"Error parsing savings PDF {pdf_path}: {e}")
         return {}
\ No newline at end of file